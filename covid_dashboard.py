@@ -6,34 +6,65 @@ It has some of it's own functions to better display data and to access the confi
 
 import logging
 import json
+import time
+import threading
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from flask import Flask, render_template, request
 import covid_data_handler as cdh
 import covid_news_handling as cnh
 
-logging.basicConfig(filename="logs.log", level=logging.DEBUG)
+logging.basicConfig(filename="logs.log", level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# the template never changes while the server is running, so there is no need for jinja to
+# check the template file for changes on every render or ever drop it from its cache.
+# jinja only reads cache_size when the environment is made, so set it before jinja_env is used
+app.jinja_options = {**app.jinja_options, "cache_size": -1}
+app.config["TEMPLATES_AUTO_RELOAD"] = False
+app.jinja_env.auto_reload = False
+
+
+@dataclass(slots=True)
+class CollatedUpdate:
+    '''
+    A scheduled update shown to the user, combining the covid and news updates with the same name.
+    '''
+    covid: bool
+    news: bool
+    time: datetime.datetime
+    repeat: bool
+
 
 scheduled_updates = {}
+update_toasts = [] # only remade when the scheduled updates change
+update_toasts_version = None # scheduled_updates_version of each handler the toasts were made from
+
+SCHEDULER_POLL_INTERVAL = 1 # seconds between checking the schedulers for updates to run
+
+# wording for update toasts, keyed on (covid, news) and repeat of the scheduled update
+UPDATE_LABELS = {
+    (True, False): "COVID Data",
+    (False, True): "Covid News",
+    (True, True): "COVID Data and Covid News"
+}
+REPEAT_LABELS = {True: " every day", False: ""}
 
 @app.route("/index", methods = ['POST', 'GET'])
 @app.route("/", methods = ['POST', 'GET'])
 def home():
     '''
-    The homepage of the covid dashboard. This will call scheduler polls,
-    collect input data, and take removed news articles and scheduled updates.
+    The homepage of the covid dashboard. This will collect input data,
+    and take removed news articles and scheduled updates.
 
         Returns:
             str: HTML code for browser to render dashboard.
     '''
-    
-    # Run schedulers in non-blocking mode everytime page is refreshed to poll events
-    # This should really be a theading.Timer()
-    logging.info("Polling schedulers")
-    cdh.scheduler.run(blocking=False)
-    cnh.scheduler.run(blocking=False)
-    
-    logging.info("User requested home page.")
+    global update_toasts
+    global update_toasts_version
+    logger.debug("User requested home page.")
     if cdh.covid_data["data"] and cdh.national_covid_data["data"]:
         # if data loaded from API successfully
         national_stats = cdh.process_covid_csv_data(cdh.national_covid_data["data"])
@@ -61,36 +92,39 @@ def home():
     repeat = bool(update_repeat)
     remove_scheduled_update = request.args.get("update_item")
     if update_covid_data or update_news:
-        logging.info("User has requested to schedule an update.")
+        logger.info("User has requested to schedule an update.")
         update_title = f"{update_name} - {update_time}"
-        logging.debug("update_title = %s", update_title)
+        logger.debug("update_title = %s", update_title)
         if update_title not in scheduled_updates:
             if update_covid_data:
                 cdh.schedule_covid_updates(update_time, update_title, repeat)
             if update_news:
                 cnh.schedule_news_updates(update_time, update_title, repeat)
         else:
-            logging.warning("""Attempted to add scheduled update with
+            logger.warning("""Attempted to add scheduled update with
             same name and time as existing scheduled update.""")
     if remove_scheduled_update:
-        logging.info("User has requested to removed a scheduled update.")
-        logging.debug("removed_scheduled_update = %s", remove_scheduled_update)
+        logger.info("User has requested to removed a scheduled update.")
+        logger.debug("removed_scheduled_update = %s", remove_scheduled_update)
         if remove_scheduled_update in scheduled_updates:
             update = scheduled_updates[remove_scheduled_update]
-            if update["news"]:
+            if update.news:
                 cnh.cancel_scheduled_update(remove_scheduled_update)
-            if update["covid"]:
+            if update.covid:
                 cdh.cancel_scheduled_update(remove_scheduled_update)
 
     if remove_news_notif:
-        logging.info("User has request article be removed")
+        logger.info("User has request article be removed")
         cnh.add_removed_article(remove_news_notif)
 
-    logging.info("Updating scheduled updates toasts")
-    collate_update_lists()
-    updates = format_update_toasts()
+    current_version = (cdh.scheduled_updates_version, cnh.scheduled_updates_version)
+    if current_version != update_toasts_version:
+        logger.info("Updating scheduled updates toasts")
+        collate_update_lists()
+        update_toasts = format_update_toasts()
+        update_toasts_version = current_version
 
-    logging.info("Rendering webpage")
+    logger.debug("Rendering webpage")
     return render_template(
         "index.html",
         title = "Covid Dashboard",
@@ -101,7 +135,7 @@ def home():
         hospital_cases = hospital_cases,
         deaths_total = deaths_total,
         news_articles = cnh.formatted_news,
-        updates = updates,
+        updates = update_toasts,
         image = "covid-19.png"
     )
 
@@ -111,22 +145,21 @@ def collate_update_lists() -> None:
     covid news handler, merges them into another dictionary to be presented to the user.
     It will combine updates with the same name/title.
     '''
-    logging.info("Collating lists of scheduled updates")
+    logger.info("Collating lists of scheduled updates")
     scheduled_updates.clear()
-    for covid_update in cdh.scheduled_updates:
-        if covid_update in cnh.scheduled_updates:
-            scheduled_updates[covid_update] = {"covid":True, "news":True,
-                "time":cdh.scheduled_updates[covid_update]["update_time"],
-                "repeat": cdh.scheduled_updates[covid_update]["repeat"]}
-        else:
-            scheduled_updates[covid_update] = {"covid":True, "news":False,
-                "time":cdh.scheduled_updates[covid_update]["update_time"],
-                "repeat": cdh.scheduled_updates[covid_update]["repeat"]}
-    for news_update in cnh.scheduled_updates:
-        if news_update not in scheduled_updates:
-            scheduled_updates[news_update] = {"covid":False, "news":True,
-                "time":cnh.scheduled_updates[news_update]["update_time"],
-                "repeat": cnh.scheduled_updates[news_update]["repeat"]}
+    # the schedulers may change their scheduled updates from their thread while we read them
+    with cdh.scheduled_updates_lock, cnh.scheduled_updates_lock:
+        for update_name in cdh.scheduled_updates | cnh.scheduled_updates:
+            # go through every update name once, whether it updates covid data, news or both.
+            # merging the dicts, not sets of keys, keeps a stable order: covid updates first in
+            # the order they were made, then updates that only update the news
+            covid_update = cdh.scheduled_updates.get(update_name)
+            news_update = cnh.scheduled_updates.get(update_name)
+            update = covid_update or news_update
+            scheduled_updates[update_name] = CollatedUpdate(
+                covid_update is not None, news_update is not None,
+                update.update_time, update.repeat
+                )
 
 
 def format_update_toasts() -> list:
@@ -134,34 +167,63 @@ def format_update_toasts() -> list:
     This will take the scheduled updates dictionary and generate a list to be
     rendered in the HTML in a way that is nicely visible to the user.
     '''
-    logging.info("Formatting scheduled updates for toasts")
+    logger.info("Formatting scheduled updates for toasts")
     formatted_updates = []
     for update_name, update_details in scheduled_updates.items():
-        update_time = update_details['time'].strftime("%H:%M")
+        update_time = update_details.time.strftime("%H:%M")
         formatted_updates.append(
             {"title": update_name,
-             "content": f"""Updating {'COVID Data'*update_details['covid']}
-             {'and' * update_details['covid'] * update_details['news']} 
-             {'Covid News'*update_details['news']}
-             at {update_time} {'every day'*update_details['repeat']}"""}
+             "content": (
+                 f"Updating {UPDATE_LABELS[(update_details.covid, update_details.news)]}"
+                 f" at {update_time}{REPEAT_LABELS[update_details.repeat]}"
+             )}
         )
     return formatted_updates
 
 
+def run_schedulers() -> None:
+    '''
+    Runs in a background thread for as long as the app is running, running scheduled covid
+    and news updates when they are due, whether or not anyone is using the dashboard.
+    '''
+    while True:
+        # scheduler.run(blocking=True) would return as soon as the queue is empty and would not
+        # notice updates scheduled while it waits, so poll the schedulers instead
+        # an update failing must not stop the thread, or no scheduled update would run again
+        try:
+            cdh.scheduler.run(blocking=False)
+        except Exception:
+            logger.exception("Scheduled COVID update failed")
+        try:
+            cnh.scheduler.run(blocking=False)
+        except Exception:
+            logger.exception("Scheduled news update failed")
+        time.sleep(SCHEDULER_POLL_INTERVAL)
+
+
 def data_init() -> None:
     '''
-    This makes the first API call before the Flask app is loaded.
+    This makes the first API call before the Flask app is loaded and starts running
+    the schedulers in the background.
     '''
-    logging.info("Making API requests before webpage starts")
-    if cdh.config_covid_location:
-        cdh.covid_data = cdh.covid_API_request(cdh.config_covid_location["area_name"],
-                                               cdh.config_covid_location["area_type"])
-    else:
-        cdh.covid_data = cdh.covid_API_request()
-    cdh.national_covid_data = cdh.covid_API_request(location_type="overview")
-    cnh.update_news()
+    logger.info("Making API requests before webpage starts")
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        # the API requests do not depend on each other so make them at the same time
+        if cdh.config_covid_location:
+            local_request = executor.submit(cdh.covid_API_request,
+                                            cdh.config_covid_location["area_name"],
+                                            cdh.config_covid_location["area_type"])
+        else:
+            local_request = executor.submit(cdh.covid_API_request)
+        national_request = executor.submit(cdh.covid_API_request, location_type="overview")
+        news_request = executor.submit(cnh.update_news)
+        cdh.covid_data = local_request.result()
+        cdh.national_covid_data = national_request.result()
+        news_request.result()
+    app.jinja_env.get_template("index.html") # compile template before the first request
+    threading.Thread(target=run_schedulers, daemon=True).start()
     if cdh.covid_data and cnh.news:
-        logging.info("All data loaded from APIs. Data init finished.")
+        logger.info("All data loaded from APIs. Data init finished.")
 
 def load_config(filename="config.json") -> None:
     '''
@@ -172,19 +234,19 @@ def load_config(filename="config.json") -> None:
         with open(filename, encoding="ascii") as config_file:
             config = json.load(config_file)
     except IOError:
-        logging.info("Config file could not be loaded. Using default values.")
+        logger.info("Config file could not be loaded. Using default values.")
         print("A config file cannot be found. Using default values.")
     else:
         try:
             cnh.config_covid_terms = config["news"]["covid_terms"]
             cdh.config_covid_location = config["covid"]
         except KeyError:
-            logging.warning("Config file values invalid. Using default values")
+            logger.warning("Config file values invalid. Using default values")
             print("The config file is invalid. Please check the values in the config file.")
         try:
             cnh.api_key = config["news"]["api_key"]
         except KeyError:
-            logging.warning("API key cannot be loaded from config. News will not be loaded.")
+            logger.warning("API key cannot be loaded from config. News will not be loaded.")
             print("""The config file does not have an API key.
             You will not be able to load any news articles.""")
 
@@ -192,8 +254,9 @@ def load_config(filename="config.json") -> None:
 
 # stream-line starting of Flask server - load data on start so when user requests home page, they
 # don't have to wait for the completion of an API call.
-# No need to prevent home page request manually as when data is being loaded, no other requests are
-# processed as program is single-threadded
+# No need to prevent home page request manually as data_init finishes before app.run() starts
+# accepting requests. After that, scheduled updates run in the run_schedulers thread alongside
+# the requests, which is why the handlers lock their scheduled_updates.
 
 
 if __name__ == "__main__":
@@ -4,32 +4,63 @@ scheduling covid updates.
 
 '''
 import logging
+import csv
+import threading
 import sched
 import datetime
 import time
-from re import match
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import requests
-from uk_covid19 import Cov19API
-import uk_covid19
+
+logger = logging.getLogger(__name__)
+
+uk_covid19 = None # imported by covid_API_request when it is first needed as it is slow to import
+
+
+@dataclass(slots=True)
+class ScheduledUpdate:
+    '''
+    A scheduled covid or news update, stored in scheduled_updates with the update name as the key.
+    Also used by covid_news_handling so the dashboard can collate both kinds of update the same way.
+    '''
+    event: sched.Event
+    update_time: datetime.datetime
+    repeat: bool
+
 
 covid_data = {}
 national_covid_data = {}
 scheduled_updates = {}
+# the schedulers run in their own thread so changes to scheduled_updates need the lock
+scheduled_updates_lock = threading.Lock()
+scheduled_updates_version = 0 # goes up every time scheduled_updates changes
 
 config_covid_location = {}
 
+COVID_API_CACHE_TTL = 300 # seconds a covid API response is reused for
+_api_cache = {} # (location, location_type): (time of request, data)
+_api_clients = {} # (location, location_type): Cov19API
+STATS_CACHE_SIZE = 2 # one entry each for the local and national data
+_stats_cache = {} # id(covid data): (covid data, key statistics), oldest first
+
 scheduler = sched.scheduler(time.time, time.sleep)
 
+HH_MM_REGEX = re.compile("^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$") # update time from dashboard form
 
-def parse_csv_data(filename:str) -> list[str]:
+
+def parse_csv_data(filename:str) -> list[dict]:
     '''
-    Take a csv file and return a list split by each row of data
+    Take a csv file and return a list of dictionaries, one for each row of data. The function turns
+    the CSV file into the same data structure that is returned from the API.
 
         Parameters:
             filename (str): The name of the Covid data CSV file
 
         Returns:
-            data_lines (list[str]): The list containing each row of data as a string
+            covid_data_local (list[dict]): Covid data seperated in list by row and
+            converted to a dictionary, with the statistics as int or None if empty
     '''
     headers = {
         "areaCode":"area_code",
@@ -41,57 +72,31 @@ def parse_csv_data(filename:str) -> list[str]:
         "newCasesBySpecimenDate":"new_cases"
     }
     try:
-        with open(str(filename), encoding="ascii") as file:
-            data_lines = file.read().splitlines() # file to list split by new lines (rows)
-            logging.info("CSV file opened successfully: %s", filename)
+        with open(str(filename), encoding="ascii", newline="") as file:
+            logger.info("CSV file opened successfully: %s", filename)
+            reader = csv.DictReader(file)
+            new_headers = []
+            for header in reader.fieldnames or []:
+                if header in headers:
+                    new_headers.append(headers[header])
+                else:
+                    logger.warning("Unknown header in the CSV file: %s", header)
+                    new_headers.append(header)
+            reader.fieldnames = new_headers
+            # renaming headers - API does this automatically, but currently reading from CSV
+            covid_data_local = []
+            for data in reader: # rows are read from the file one at a time
+                for header in ("new_cases", "hospital_cases", "cum_deaths"):
+                    data[header] = int(data[header]) if data.get(header) else None
+                    # convert statistics to int once here, empty entries become None like the API
+                covid_data_local.append(data)
     except IOError:
-        logging.warning("Cannot open CSV file")
+        logger.warning("Cannot open CSV file")
     else:
-        file_headers = data_lines[0].split(",")
-        new_headers = []
-        for header in file_headers:
-            if header in headers:
-                new_headers.append(headers[header])
-            else:
-                logging.warning("Unknown header in the CSV file: %s", header)
-                new_headers.append(header)
-        data_lines[0] = ",".join(new_headers)
-        # renaming headers - API does this automatically, but currently reading from CSV
-        covid_data_local = convert_covid_csv_data_to_list_dict(data_lines)
+        covid_data_local.sort(key = lambda x: x['date'], reverse=True)
+        # just in case data is not in order sort by date, most recent date as index 0.
         return covid_data_local
 
-
-def convert_covid_csv_data_to_list_dict(covid_csv_data:list[str]) -> list[dict]:
-    '''
-    Takes the parsed csv covid data and split rows into lists appendding each row to a new list
-    This function is only necessary when reading from a CSV. The function turns the CSV file into
-    the same data structure that is returned from the API.
-
-        Parameters:
-            covid_csv_data (list[str]): Covid data parsed through the function parse_csv_data
-            the data is each row of data as a string of the entire row
-
-        Returns:
-            covid_data_local (list[dict]): Covid data seperated in list by row and
-            converted to a dictionary
-    '''
-    logging.info("""convert_covid_csv_data_to_list_dict called:
-    Converting CSV file to list of dictionaries for further data processing.""")
-    covid_data_headers = covid_csv_data[0].split(',') # save covid data headers for dict
-    covid_csv_data_local = covid_csv_data[1:] # store data excluding headers in another list
-    covid_data_local = []
-    for row in covid_csv_data_local:
-        row_data = row.split(',') # split row into individual pieces of data
-        data = {}
-        for header, data_entry in zip(covid_data_headers, row_data):
-            data[header] = data_entry
-            # take individual data and map header (data title) to data in dict
-        covid_data_local.append(data)
-        # add dict to list of Covid data
-    covid_data_local.sort(key = lambda x: x['date'], reverse=True)
-    # just in case data is not in order sort by date, most recent date as index 0.
-    return covid_data_local
-
 def process_covid_csv_data(covid_data_local:list[dict]) -> tuple[int|str, int|str, int|str]:
     '''
     Takes the Covid data processed from parse_csv_data and returns the number of cases for the past
@@ -109,46 +114,50 @@ def process_covid_csv_data(covid_data_local:list[dict]) -> tuple[int|str, int|st
             cum_deaths (int|str): The number of cumulative deaths from the most recent data
                 or N/A if not applicable
     '''
-    logging.info("""process_covid_csv_data called:
+    cached_stats = _stats_cache.get(id(covid_data_local))
+    if cached_stats is not None and cached_stats[0] is covid_data_local:
+        # the data has not changed since the statistics were last calculated
+        return cached_stats[1]
+    logger.info("""process_covid_csv_data called:
     Processing COVID data to generate 3 key statistics""")
-    first_date = next(
-        (index for index, item in enumerate(covid_data_local) if item['new_cases']), None
-        ) # finding the index of the first non empty entry of data.
-          # if there is valid entry, return none.
+    first_date = first_hospital = first_deaths = None
+    for index, item in enumerate(covid_data_local):
+        # find the index of the first non empty entry of each statistic in one pass
+        if first_date is None and item['new_cases'] is not None:
+            first_date = index
+        if first_hospital is None and item['hospital_cases'] is not None:
+            first_hospital = index
+        if first_deaths is None and item['cum_deaths'] is not None:
+            first_deaths = index
+        if first_date is not None and first_hospital is not None and first_deaths is not None:
+            break # found all three, no need to look through the rest of the data
     if first_date is not None: # test to mkae sure there is data
         first_date += 1 # skip the first day
-        if len(covid_data_local) - first_date > 7:
-            days = 7 # if there are 7 days worth of data
-        else:
-            days = len(covid_data_local) - first_date
-            # if not, then just calculate the remaining amounts of data
-        total_cases_last_7_days = 0
-        for days in range(days):
-            total_cases_last_7_days += int(
-                covid_data_local[first_date+days]['new_cases']
-            ) # loop through 7 days and add all of them to total
+        total_cases_last_7_days = sum(
+            day['new_cases'] for day in covid_data_local[first_date:first_date+7]
+        ) # add up the cases of the 7 days, or of what is left if there are less than 7 days
     else: # if there is no data
-        logging.info("There is no data to calculate the 7 day covid rate.")
+        logger.info("There is no data to calculate the 7 day covid rate.")
         total_cases_last_7_days = "N/A"
 
-    # The following is the while loop as above but for the next statistics, without adding 1 day
-    first_date = next(
-        (i for i, item in enumerate(covid_data_local) if item['hospital_cases']), None
-        ) # this is the same as the next() statement as above but for hospital cases
-    if first_date is not None: # makes sure data is there as some API calls don't have this data.
-        hospital_cases = int(covid_data_local[first_date]['hospital_cases'])
+    # The following statistics use the most recent entry, without skipping 1 day
+    if first_hospital is not None: # make sure data is there as some API calls don't have it.
+        hospital_cases = covid_data_local[first_hospital]['hospital_cases']
     else: # if API call doesn't have this data, simply diplay N/A to user.
-        logging.info("There is insufficient data to show hospital cases.")
+        logger.info("There is insufficient data to show hospital cases.")
         hospital_cases = "N/A"
-    first_date = next(
-        (i for i, item in enumerate(covid_data_local) if item['cum_deaths']), None
-        ) # this is the same as the next() statement as above but for cumulative deaths
-    if first_date is not None: # makes sure data is there as some API calls don't have this data.
-        cum_deaths = int(covid_data_local[first_date]["cum_deaths"])
+    if first_deaths is not None: # makes sure data is there as some API calls don't have this data.
+        cum_deaths = covid_data_local[first_deaths]["cum_deaths"]
     else: # if API call doesn't have this data, simply display N/A to user.
-        logging.info("There is insufficient data to show cumulative deaths.")
+        logger.info("There is insufficient data to show cumulative deaths.")
         cum_deaths = "N/A"
-    return total_cases_last_7_days, hospital_cases, cum_deaths
+    stats = total_cases_last_7_days, hospital_cases, cum_deaths
+    if len(_stats_cache) >= STATS_CACHE_SIZE:
+        # forget the oldest statistics so the cache doesn't keep old data alive
+        del _stats_cache[next(iter(_stats_cache))]
+    _stats_cache[id(covid_data_local)] = (covid_data_local, stats)
+    # keeping a reference to the data means its id cannot be reused while it is cached
+    return stats
 
 def covid_API_request(location:str = "Exeter", location_type:str = "ltla") -> dict:
     '''
@@ -162,37 +171,53 @@ def covid_API_request(location:str = "Exeter", location_type:str = "ltla") -> di
          Returns:
             data (dict): The data the API returns based on the filter and structure provided
     '''
-    logging.info("Beginning API request to update COVID data.")
-    if location_type != "overview":
-        location_data = [
-            "areaType="+location_type,
-            "areaName="+location
-            ]
-    else: # if areaType is overview, there is no need for areaName in request
-        location_data = ["areaType=overview"]
-     # generate a filter as required by covid API
-    structure_data = {
-        "area_name": "areaName",
-        "date": "date",
-        "cum_deaths": "cumDailyNsoDeathsByDeathDate",
-        "hospital_cases": "hospitalCases",
-        "new_cases": "newCasesBySpecimenDate"
-    } # information needed from API and renaming as per API parameters
+    cache_key = (location, location_type)
+    if cache_key in _api_cache:
+        request_time, data = _api_cache[cache_key]
+        if time.time() - request_time < COVID_API_CACHE_TTL:
+            # data only changes daily so no need to ask the API again so soon
+            logger.info("Using cached COVID data for %s", location)
+            return data
+    global uk_covid19
+    if uk_covid19 is None:
+        import uk_covid19
+    logger.info("Beginning API request to update COVID data.")
+    if cache_key not in _api_clients:
+        # the filter and structure only depend on the location so the API object is made once
+        if location_type != "overview":
+            location_data = [
+                "areaType="+location_type,
+                "areaName="+location
+                ]
+        else: # if areaType is overview, there is no need for areaName in request
+            location_data = ["areaType=overview"]
+         # generate a filter as required by covid API
+        structure_data = {
+            "area_name": "areaName",
+            "date": "date",
+            "cum_deaths": "cumDailyNsoDeathsByDeathDate",
+            "hospital_cases": "hospitalCases",
+            "new_cases": "newCasesBySpecimenDate"
+        } # information needed from API and renaming as per API parameters
+        _api_clients[cache_key] = uk_covid19.Cov19API(
+            filters=location_data, structure=structure_data
+            )
     try:
-        api = Cov19API(filters=location_data, structure=structure_data)
+        api = _api_clients[cache_key]
         data = api.get_json() # json data already processed by API.
-        logging.info("API call completed")
+        logger.info("API call completed")
+        _api_cache[cache_key] = (time.time(), data)
         return data
     except uk_covid19.exceptions.FailedRequestError as error:
         # may occur if there is a connection error
-        logging.warning("COVID API call failed: %s", error)
+        logger.warning("COVID API call failed: %s", error)
         print("COVID API call failed: Check internet connection")
         print("Retrying in 30 seconds...")
         schedule_covid_updates(30, "API Retry")
         return {"data": None}
     except requests.exceptions.ConnectionError as error:
         # may occur if there is a connection error
-        logging.warning("COVID API call failed: %s", error)
+        logger.warning("COVID API call failed: %s", error)
         print("COVID API call failed: Check internet connection")
         print("Retrying in 30 seconds...")
         schedule_covid_updates(30, "API Retry")
@@ -210,23 +235,36 @@ def sch_update_covid_data(update_time: datetime.datetime, update_name: int, repe
     '''
     global covid_data
     global national_covid_data
+    global scheduled_updates_version
     # no way around using global variables here. They needs to be assigned on update
-    logging.info("Running scheduled COVID update %s", update_name)
-    del scheduled_updates[update_name] # scheduled update called, delete from dict
-    if config_covid_location: # make sure that covid API requests use config data if it is there
-        location_type = config_covid_location["area_type"]
-        location = config_covid_location["area_name"]
-        api_response = covid_API_request(location, location_type)
-    else:
-        api_response = covid_API_request()
-    national_api_response = covid_API_request(location_type="overview")
+    logger.info("Running scheduled COVID update %s", update_name)
+    with scheduled_updates_lock:
+        # scheduled update called, delete from dict. If it is not there, the update was
+        # cancelled from the dashboard after the scheduler took it off the queue
+        if scheduled_updates.pop(update_name, None) is None:
+            logger.info("COVID update %s was cancelled before it ran", update_name)
+            return
+        scheduled_updates_version += 1
+    _api_cache.clear() # scheduled updates should always get fresh data from the API
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # make the local and national requests at the same time
+        if config_covid_location: # make sure that covid API requests use config data if it is there
+            location_type = config_covid_location["area_type"]
+            location = config_covid_location["area_name"]
+            local_request = executor.submit(covid_API_request, location, location_type)
+        else:
+            local_request = executor.submit(covid_API_request)
+        national_request = executor.submit(covid_API_request, location_type="overview")
+        api_response = local_request.result()
+        national_api_response = national_request.result()
     if api_response:
         covid_data = api_response
     if national_api_response:
         national_covid_data = national_api_response
+    _stats_cache.clear() # statistics need to be calculated again from the new data
     if repeat: # this is for if the user requested a repeating update
         update_time = update_time + datetime.timedelta(days=1)
-        logging.info("Covid update (%s) to be repeated. Scheduling next update", update_name)
+        logger.info("Covid update (%s) to be repeated. Scheduling next update", update_name)
         schedule_covid_updates(update_time, update_name, repeat)
 
 def cancel_scheduled_update(update_name:str) -> None:
@@ -236,19 +274,29 @@ def cancel_scheduled_update(update_name:str) -> None:
         Parameters:
             update_name(str): The key of the scheduled update in dict
     '''
-    logging.info("Cancelling schduled COVID update named: %s", update_name)
-    if update_name in scheduled_updates:
-        # if the update exists, then find the event and remove it from the scheduler and
-        # list of scheduled updates
-        event = scheduled_updates[update_name]["event"]
-        scheduler.cancel(event)
-        del scheduled_updates[update_name]
-        logging.info("%s successfully removed from scheduled COVID updates", update_name)
-        logging.debug("COVID scheduled_updates = %s", scheduled_updates)
-        logging.debug("COVID Scheduler queue = %s", scheduler.queue)
-    else:
-        logging.warning("""Attempted to remove scheduled update event from scheduler
-        but event does not exist: %s""", update_name)
+    global scheduled_updates_version
+    logger.info("Cancelling schduled COVID update named: %s", update_name)
+    with scheduled_updates_lock:
+        if update_name in scheduled_updates:
+            # if the update exists, then find the event and remove it from the scheduler and
+            # list of scheduled updates
+            event = scheduled_updates[update_name].event
+            try:
+                scheduler.cancel(event)
+            except ValueError:
+                # the scheduler thread has just taken the event off the queue to run it,
+                # sch_update_covid_data sees it is no longer in the dict and does nothing
+                logger.info("%s was about to run and will be skipped", update_name)
+            del scheduled_updates[update_name]
+            scheduled_updates_version += 1
+            logger.info("%s successfully removed from scheduled COVID updates", update_name)
+            if logger.isEnabledFor(logging.DEBUG):
+                # scheduler.queue makes a sorted copy of the queue so only get it when logged
+                logger.debug("COVID scheduled_updates = %s", scheduled_updates)
+                logger.debug("COVID Scheduler queue = %s", scheduler.queue)
+        else:
+            logger.warning("""Attempted to remove scheduled update event from scheduler
+            but event does not exist: %s""", update_name)
 
 
 def schedule_covid_updates(update_interval: int|str|datetime.datetime,
@@ -266,61 +314,63 @@ def schedule_covid_updates(update_interval: int|str|datetime.datetime,
             update_name (str): the name of the scheduled update
             repeat (bool): whether the update is repeating
     '''
-    logging.info("Scheduling covid update: %s", update_name)
+    global scheduled_updates_version
+    logger.info("Scheduling covid update: %s", update_name)
+    now = datetime.datetime.now() # so all the time calculations below agree with each other
     if isinstance(update_interval, str):
-        logging.info("Recieved string. Attempting to parse...")
+        logger.info("Recieved string. Attempting to parse...")
         # if it's a string, test if its coming from the dashboard and therefore HH:MM format
-        if match("^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$", update_interval):
+        if HH_MM_REGEX.match(update_interval):
             time_to_update, update_time = time_to_update_interval(update_interval)
-            logging.debug("time_to_update = %s", str(time_to_update))
-            logging.debug("update_time = %s", str(update_time))
+            logger.debug("time_to_update = %s", time_to_update)
+            logger.debug("update_time = %s", update_time)
         elif update_interval.isdigit():
             update_interval = int(update_interval)
             # this will trigger the if statement below for int types
         else:
-            logging.warning("Can't parse update time. Cancelling update scheduling")
+            logger.warning("Can't parse update time. Cancelling update scheduling")
             # If we can't parse the update time parameter, cancel and exit function
             return None
     if isinstance(update_interval, datetime.datetime):
         # if datetime object, calcuate time to next update
-        logging.info("Recieved datetime object.")
+        logger.info("Recieved datetime object.")
         update_time = update_interval
-        if update_time < datetime.datetime.now():
-            update_time = datetime.datetime.now().replace(
+        if update_time < now:
+            update_time = now.replace(
                 hour=update_time.hour, minute=update_time.minute, second=0, microsecond=0
                 )
-            if update_time < datetime.datetime.now():
+            if update_time < now:
                 update_time += datetime.timedelta(days=1)
             # if the datetime object is in the past, we assume the next point where that
             # hour and minute occur
-        time_to_update = (update_time - datetime.datetime.now()).total_seconds()
+        time_to_update = (update_time - now).total_seconds()
     if isinstance(update_interval, int):
         # if int, calculate datetime object of update
-        logging.info("Recieved int. Parsing as seconds from now.")
+        logger.info("Recieved int. Parsing as seconds from now.")
         time_to_update = abs(update_interval)
         # if number is negative, assume absolute value anyways
-        update_time = datetime.datetime.now() + datetime.timedelta(seconds = update_interval)
-    logging.info("Covid update time has been parsed")
-    logging.debug("Update time parsed as %s", str(update_time))
-
-    if update_name not in scheduled_updates:
-        # make sure we are not trying to create an update with a duplicate name
-        event = scheduler.enter(
-            time_to_update,1,sch_update_covid_data,(update_time, update_name, repeat, )
-            )
-        scheduled_updates[update_name] = {
-            "event": event,
-            "update_time":update_time,
-            "repeat":repeat
-            }
-        logging.info("Scheduled COVID update: %s", update_name)
-        logging.debug("Scheduler Queue (covid): %s", str(scheduler.queue))
-    else:
-        # should modify HTML to tell user that the app cannot schedule update as the
-        # update name is already in use but outside bounds of CA
-        logging.warning("Tried to schedule update with same name as existing update")
-        logging.debug("Update Name: %s", update_name)
-        logging.debug("Scheduler Queue (covid): %s", str(scheduler.queue))
+        update_time = now + datetime.timedelta(seconds = update_interval)
+    logger.info("Covid update time has been parsed")
+    logger.debug("Update time parsed as %s", update_time)
+
+    with scheduled_updates_lock:
+        if update_name not in scheduled_updates:
+            # make sure we are not trying to create an update with a duplicate name
+            event = scheduler.enter(
+                time_to_update,1,sch_update_covid_data,(update_time, update_name, repeat, )
+                )
+            scheduled_updates[update_name] = ScheduledUpdate(event, update_time, repeat)
+            scheduled_updates_version += 1
+            logger.info("Scheduled COVID update: %s", update_name)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Scheduler Queue (covid): %s", scheduler.queue)
+        else:
+            # should modify HTML to tell user that the app cannot schedule update as the
+            # update name is already in use but outside bounds of CA
+            logger.warning("Tried to schedule update with same name as existing update")
+            logger.debug("Update Name: %s", update_name)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Scheduler Queue (covid): %s", scheduler.queue)
 
 def time_to_update_interval(update_interval:str) -> tuple[int, datetime.datetime]:
     '''
@@ -334,13 +384,14 @@ def time_to_update_interval(update_interval:str) -> tuple[int, datetime.datetime
             time_to_update (int): The amount of seconds from now to the update time
             update_time (datetime.datetime): datetime object that corresponds to the update time
     '''
-    logging.info("Converting string to datetime object and seconds to update")
-    logging.debug("update_interval = %s", str(update_interval))
+    logger.info("Converting string to datetime object and seconds to update")
+    logger.debug("update_interval = %s", update_interval)
     hrs, mins = map(int, update_interval.split(":"))
-    update_time = datetime.datetime.now().replace(hour=hrs, minute=mins, second=0, microsecond=0)
-    if update_time < datetime.datetime.now():
+    now = datetime.datetime.now()
+    update_time = now.replace(hour=hrs, minute=mins, second=0, microsecond=0)
+    if update_time < now:
         update_time = update_time + datetime.timedelta(days=1)
-    time_to_update = (update_time - datetime.datetime.now()).total_seconds()
+    time_to_update = (update_time - now).total_seconds()
     return time_to_update, update_time
 
 
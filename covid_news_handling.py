@@ -7,20 +7,44 @@ import time
 import sched
 import logging
 import datetime
-from re import match
+import threading
+import re
+from itertools import islice
 import requests
-from markupsafe import Markup
+from markupsafe import Markup, escape
+from covid_data_handler import ScheduledUpdate # same as covid updates so they can be collated
+
+logger = logging.getLogger(__name__)
 
 api_key = '' # not a constant. changes based on config
 config_covid_terms = "" # not a constant. changes based on config
 
 news = []
 formatted_news = []
-removed_articles = []
+removed_articles = set() # titles of articles removed by the user
+
+NEWS_API_TIMEOUT = (3.05, 10) # seconds to connect, seconds to wait for the response
+# one session for all news API requests so the connection is kept open between requests
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4))
+_etag_cache = {} # url: (ETag, data) of the last response for each request url
+_news_response = None # the response the news list was last filled from
+
+# pieces of the <a> tag around each article's content, joined with the url and content
+LINK_OPEN = "<a href='"
+LINK_MIDDLE = "' style='color:black'>"
+LINK_CLOSE = "...</a>"
+
+_format_cache = {"key": None, "formatted_news": []} # last news shown and how it was formatted
 
 scheduler = sched.scheduler(time.time, time.sleep)
 
+HH_MM_REGEX = re.compile("^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$") # update time from dashboard form
+
 scheduled_updates = {}
+# the schedulers run in their own thread so changes to scheduled_updates need the lock
+scheduled_updates_lock = threading.Lock()
+scheduled_updates_version = 0 # goes up every time scheduled_updates changes
 
 def news_API_request(covid_terms:str = "Covid COVID-19 coronavirus") -> dict:
     '''
@@ -34,39 +58,50 @@ def news_API_request(covid_terms:str = "Covid COVID-19 coronavirus") -> dict:
     '''
     if config_covid_terms:
         covid_terms = config_covid_terms
-    logging.info("Beginning News API request")
-    covid_terms_list = covid_terms.split(" ")
-    url = f'''https://newsapi.org/v2/everything?q=+{"+".join(covid_terms_list)}&apikey={api_key}'''
+    logger.info("Beginning News API request")
+    url = f"https://newsapi.org/v2/everything?q=+{covid_terms.replace(' ', '+')}&apikey={api_key}"
+    cached_response = _etag_cache.get(url)
+    # ask the API to only send the news if it has changed since the last request
+    headers = {"If-None-Match": cached_response[0]} if cached_response else {}
     try:
-        response = requests.get(url)
-        logging.info("API request successful")
-        return response.json()
+        response = _session.get(url, headers=headers, timeout=NEWS_API_TIMEOUT)
+        if response.status_code == 304 and cached_response:
+            logger.info("News has not changed since the last API request")
+            return cached_response[1]
+        logger.info("API request successful")
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag and response.ok:
+            _etag_cache[url] = (etag, data)
+        return data
     # The following are possible responses if internet is unstable or down
     # If API request fails, schedule a new attempt in 30 seconds and inform user.
-    except requests.exceptions.ConnectionError as error:
-        logging.warning("Connection Error: %s", error)
-        print("Connection error: News API call failed. Check internet connection.")
-        print("Retrying in 30 seconds...")
-        schedule_news_updates(30, "API Retry")
-    except requests.exceptions.Timeout as error:
-        logging.warning("Connection Timed Out: %s", error)
-        print("Connection timed out: News API call failed. Check internet connection.")
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+        logger.warning("News API call failed: %s", error)
+        print("News API call failed. Check internet connection.")
         print("Retrying in 30 seconds...")
         schedule_news_updates(30, "API Retry")
 
 def update_news(terms = "Covid COVID-19 coronavirus") -> None:
     '''
     Calls the news_API_request then updates the news list. This is clear the list the be re-filled
-    with news articles except those that have been removed by the user.
+    with news articles except those that have been removed by the user. If the request fails, the
+    current news is kept.
     '''
-    logging.info("Updating Covid News")
+    global _news_response
+    logger.info("Updating Covid News")
     api_response = news_API_request(terms)
-    news.clear()
+    if api_response is not None and api_response is _news_response:
+        # the API returned the same data as last time, so the news list is already up to date
+        logger.info("News is already up to date")
+        return
     if api_response:
         if not api_response["status"] == "error":
-            for article in api_response["articles"]:
-                if article["title"] not in removed_articles:
-                    news.append(article)
+            news[:] = [
+                article for article in api_response["articles"]
+                if article["title"] not in removed_articles
+            ] # replace contents rather than the list so other modules see the new news
+            _news_response = api_response
             news_formatter()
 
 def news_formatter() -> None:
@@ -75,37 +110,48 @@ def news_formatter() -> None:
     and the article contents. Will format the contents to 100 characters long and put within
     a HTML <a> tag to hyperlink content to article link.
     '''
-    logging.info("Formatting news for dashboard.")
-    formatted_news.clear()
-    if len(news) >= 5:
-        temp_news_list = news[:5]
-    else:
-        temp_news_list = news[:]
-    for article in temp_news_list:
+    cache_key = tuple(
+        (article['url'], article['title'], article.get('content'))
+        for article in islice(news, 5)
+    ) # everything the formatted news is made from
+    if _format_cache["key"] == cache_key:
+        # the articles shown have not changed since they were last formatted
+        formatted_news[:] = _format_cache["formatted_news"]
+        return
+    logger.info("Formatting news for dashboard.")
+    new_formatted_news = []
+    for article in islice(news, 5): # only the first 5 articles are shown
         temp_formatted = {}
         url = article['url']
         temp_formatted["title"] = article['title']
-        content = Markup(f"""<a href = '{url}'
-                         style = 'color:black'>{article['content'][0:100]}...</a>""")
+        content_text = (article.get('content') or '')[:100] # newsapi content can be null
+        content = Markup("".join(
+            (LINK_OPEN, escape(url), LINK_MIDDLE, escape(content_text), LINK_CLOSE)
+            )) # escaped once here so the template can render it as it is
         temp_formatted["content"] = content
-        formatted_news.append(temp_formatted)
+        new_formatted_news.append(temp_formatted)
+    formatted_news[:] = new_formatted_news # keep the same list as the dashboard uses it
+    _format_cache.update(key=cache_key, formatted_news=new_formatted_news)
 
 def add_removed_article(article_title:str) -> None:
     '''
-    Called when the user removes an article. This will add the removed article to a list and call
+    Called when the user removes an article. This will add the removed article to a set and call
     the news_formatted function. The user will never see the same article again and will be removed
     from the dashboard.
     '''
-    removed_articles.append(article_title)
-    article_titles = [article_title_news['title'] for article_title_news in news]
-    if article_title in article_titles:
-        article_index = article_titles.index(article_title)
-        del news[article_index]
-        logging.info("%s has been removed. Will not be shown again", article_title)
+    removed_articles.add(article_title)
+    for article_index, article in enumerate(news):
+        if article['title'] == article_title:
+            del news[article_index]
+            logger.info("%s has been removed. Will not be shown again", article_title)
+            break
     else:
-        logging.warning("User has attempted to remove an article that doesn't exist.")
-        logging.debug("%s was to be removed", article_title)
-        logging.debug("%s are the articles that are in the list", str(article_titles))
+        logger.warning("User has attempted to remove an article that doesn't exist.")
+        if logger.isEnabledFor(logging.DEBUG):
+            # only list the titles of all the articles if they will actually be logged
+            logger.debug("%s was to be removed", article_title)
+            logger.debug("%s are the articles that are in the list",
+                          [article['title'] for article in news])
     news_formatter()
 
 def sch_update_news(update_time: datetime.datetime, update_name: str, repeat: bool) -> None:
@@ -118,12 +164,19 @@ def sch_update_news(update_time: datetime.datetime, update_name: str, repeat: bo
             update_name (str): the name of the scheduled update
             repeat (bool): whether the update is repeating
     '''
-    logging.info("Running scheduled news update %s", update_name)
-    del scheduled_updates[update_name] # scheduled update called, delete from dict
+    global scheduled_updates_version
+    logger.info("Running scheduled news update %s", update_name)
+    with scheduled_updates_lock:
+        # scheduled update called, delete from dict. If it is not there, the update was
+        # cancelled from the dashboard after the scheduler took it off the queue
+        if scheduled_updates.pop(update_name, None) is None:
+            logger.info("News update %s was cancelled before it ran", update_name)
+            return
+        scheduled_updates_version += 1
     update_news()
     if repeat: # this is for if the user requested a repeating update
         update_time = update_time + datetime.timedelta(days=1)
-        logging.info("News update (%s) to be repeated. Scheduling next update", update_name)
+        logger.info("News update (%s) to be repeated. Scheduling next update", update_name)
         schedule_news_updates(update_time, update_name, repeat)
 
 def cancel_scheduled_update(update_name:str) -> None:
@@ -133,19 +186,27 @@ def cancel_scheduled_update(update_name:str) -> None:
         Parameters:
             update_name(str): The key of the scheduled update in dict
     '''
-    logging.info("Cancelling scheduled news update %s", update_name)
-    if update_name in scheduled_updates:
-        # if the update exists, then find the event and remove it from the scheduler and
-        # list of scheduled updates
-        event = scheduled_updates[update_name]["event"]
-        scheduler.cancel(event)
-        del scheduled_updates[update_name]
-        logging.info("%s successfully removed from scheduled news updates", update_name)
-        logging.debug("news scheduled_updates = %s", scheduled_updates)
-        logging.debug("news Scheduler queue = %s", scheduler.queue)
-    else:
-        logging.warning("""A request has been sent to cancel
-        a scheduled news update that does not exist""")
+    global scheduled_updates_version
+    logger.info("Cancelling scheduled news update %s", update_name)
+    with scheduled_updates_lock:
+        update = scheduled_updates.pop(update_name, None)
+        if update is not None:
+            # if the update exists, then remove its event from the scheduler as well
+            try:
+                scheduler.cancel(update.event)
+            except ValueError:
+                # the scheduler thread has just taken the event off the queue to run it,
+                # sch_update_news sees it is no longer in the dict and does nothing
+                logger.info("%s was about to run and will be skipped", update_name)
+            scheduled_updates_version += 1
+            logger.info("%s successfully removed from scheduled news updates", update_name)
+            if logger.isEnabledFor(logging.DEBUG):
+                # scheduler.queue makes a sorted copy of the queue so only get it when logged
+                logger.debug("news scheduled_updates = %s", scheduled_updates)
+                logger.debug("news Scheduler queue = %s", scheduler.queue)
+        else:
+            logger.warning("""A request has been sent to cancel
+            a scheduled news update that does not exist""")
 
 def schedule_news_updates(update_interval: int|str|datetime.datetime,
                           update_name: int, repeat=False) -> None:
@@ -162,61 +223,63 @@ def schedule_news_updates(update_interval: int|str|datetime.datetime,
             update_name (str): the name of the scheduled update
             repeat (bool): whether the update is repeating
     '''
-    logging.info("Scheduling news update: %s", update_name)
+    global scheduled_updates_version
+    now = datetime.datetime.now() # so all the time calculations below agree with each other
     if isinstance(update_interval, str):
-        logging.info("Recieved string. Attempting to parse...")
         # if it's a string, test if its coming from the dashboard and therefore HH:MM format
-        if match("^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$", update_interval):
+        if HH_MM_REGEX.match(update_interval):
             time_to_update, update_time = time_to_update_interval(update_interval)
-            logging.debug("time_to_update = %s", str(time_to_update))
-            logging.debug("update_time = %s", str(update_time))
         elif update_interval.isdigit():
             update_interval = int(update_interval)
             # this will trigger the if statement below for int types
         else:
-            logging.warning("Can't parse update time. Cancelling update scheduling")
+            logger.warning("Can't parse update time for news update %s. Cancelling scheduling",
+                           update_name)
             # If we can't parse the update time parameter, cancel and exit function
             return None
     if isinstance(update_interval, datetime.datetime):
         # if datetime object, calcuate time to next update
-        logging.info("Recieved datetime object.")
         update_time = update_interval
-        if update_time < datetime.datetime.now():
-            update_time = datetime.datetime.now().replace(
+        if update_time < now:
+            update_time = now.replace(
                 hour=update_time.hour, minute=update_time.minute, second=0, microsecond=0
                 )
-            if update_time < datetime.datetime.now():
+            if update_time < now:
                 update_time += datetime.timedelta(days=1)
             # if the datetime object is in the past, we assume the next point where that
             # hour and minute occur
-        time_to_update = (update_time - datetime.datetime.now()).total_seconds()
+        time_to_update = (update_time - now).total_seconds()
     if isinstance(update_interval, int):
         # if int, calculate datetime object of update
-        logging.info("Recieved int. Parsing as seconds from now.")
         time_to_update = abs(update_interval)
         # if number is negative, assume absolute value anyways
-        update_time = datetime.datetime.now() + datetime.timedelta(seconds = update_interval)
-    logging.info("Covid update time has been parsed")
-    logging.debug("Update time parsed as %s", str(update_time))
-
-    if update_name not in scheduled_updates:
-        # make sure we are not trying to create an update with a duplicate name
-        event = scheduler.enter(
-            time_to_update,1,sch_update_news,(update_time, update_name, repeat, )
-            )
-        scheduled_updates[update_name] = {
-            "event": event,
-            "update_time":update_time,
-            "repeat":repeat
-            }
-        logging.info("Scheduled news update: %s", update_name)
-        logging.debug("Scheduler Queue (news): %s", str(scheduler.queue))
-    else:
-        # should modify HTML to tell user that the app cannot schedule update as the
-        # update name is already in use but outside bounds of CA
-        logging.warning("Tried to schedule update with same name as existing update")
-        logging.debug("Update Name: %s", update_name)
-        logging.debug("Scheduler Queue (news): %s", str(scheduler.queue))
+        update_time = now + datetime.timedelta(seconds = update_interval)
+
+    with scheduled_updates_lock:
+        if update_name not in scheduled_updates:
+            # make sure we are not trying to create an update with a duplicate name
+            event = scheduler.enter(
+                time_to_update,1,sch_update_news,(update_time, update_name, repeat, )
+                )
+            scheduled_updates[update_name] = ScheduledUpdate(event, update_time, repeat)
+            scheduled_updates_version += 1
+            # one log record with everything about the update rather than one for each step
+            logger.info("Scheduled news update: %s", {
+                "name": update_name,
+                "parsed_as": type(update_interval).__name__,
+                "update_time": update_time,
+                "time_to_update": time_to_update,
+                "repeat": repeat
+                })
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Scheduler Queue (news): %s", scheduler.queue)
+        else:
+            # should modify HTML to tell user that the app cannot schedule update as the
+            # update name is already in use but outside bounds of CA
+            logger.warning("Tried to schedule news update with same name as existing update: %s",
+                           update_name)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Scheduler Queue (news): %s", scheduler.queue)
 
 def time_to_update_interval(update_interval:str) -> tuple[int,int]:
     '''
@@ -231,12 +294,13 @@ def time_to_update_interval(update_interval:str) -> tuple[int,int]:
             update_time (datetime.datetime): datetime object that corresponds to the update time
     '''
     # this function is called when recieving time from dashboard (HH:MM format)
-    logging.info("Converting string to datetime object and seconds to update")
-    logging.debug("update_interval = %s", str(update_interval))
+    logger.info("Converting string to datetime object and seconds to update")
+    logger.debug("update_interval = %s", update_interval)
     hrs, mins = map(int, update_interval.split(":"))
     # calculate datetime object of update
-    update_time = datetime.datetime.now().replace(hour=hrs, minute=mins, second=0, microsecond=0)
-    if update_time < datetime.datetime.now():
+    now = datetime.datetime.now()
+    update_time = now.replace(hour=hrs, minute=mins, second=0, microsecond=0)
+    if update_time < now:
         update_time = update_time + datetime.timedelta(days=1)
-    time_to_update = (update_time - datetime.datetime.now()).total_seconds()
+    time_to_update = (update_time - now).total_seconds()
     return time_to_update, update_time
@@ -0,0 +1,44 @@
+import datetime
+import covid_dashboard as cd
+import covid_data_handler as cdh
+import covid_news_handling as cnh
+
+def test_format_update_toasts():
+    # test covid only, news only, both and repeating updates
+    temp_covid_updates = dict(cdh.scheduled_updates)
+    temp_news_updates = dict(cnh.scheduled_updates)
+    cdh.scheduled_updates.clear()
+    cnh.scheduled_updates.clear()
+    cdh.scheduled_updates["covid only"] = cdh.ScheduledUpdate(
+        None, datetime.datetime(2021, 1, 1, 12, 30), False)
+    cnh.scheduled_updates["news only"] = cnh.ScheduledUpdate(
+        None, datetime.datetime(2021, 1, 1, 13, 45), True)
+    cdh.scheduled_updates["both"] = cdh.ScheduledUpdate(
+        None, datetime.datetime(2021, 1, 1, 9, 5), False)
+    cnh.scheduled_updates["both"] = cnh.ScheduledUpdate(
+        None, datetime.datetime(2021, 1, 1, 9, 5), False)
+
+    cd.collate_update_lists()
+    updates = cd.format_update_toasts()
+    assert updates == [
+        {"title": "covid only", "content": "Updating COVID Data at 12:30"},
+        {"title": "both", "content": "Updating COVID Data and Covid News at 09:05"},
+        {"title": "news only", "content": "Updating Covid News at 13:45 every day"}
+    ]
+
+    cdh.scheduled_updates.clear()
+    cnh.scheduled_updates.clear()
+    cdh.scheduled_updates.update(temp_covid_updates)
+    cnh.scheduled_updates.update(temp_news_updates)
+    cd.collate_update_lists()
+
+def test_scheduled_updates_version():
+    # test the toasts are rebuilt whenever an update is scheduled or cancelled
+    for handler, schedule_update in ((cdh, cdh.schedule_covid_updates),
+                                     (cnh, cnh.schedule_news_updates)):
+        version = handler.scheduled_updates_version
+        schedule_update(update_interval=60, update_name='version test')
+        assert handler.scheduled_updates_version != version
+        version = handler.scheduled_updates_version
+        handler.cancel_scheduled_update('version test')
+        assert handler.scheduled_updates_version != version
@@ -5,7 +5,7 @@ def test_parse_csv_data():
     data = cdh.parse_csv_data('nation_2021-10-28.csv')
     assert len(data) == 638 # THIS HAS BEEN CHANGED:
     # this has been changed as I have used a different data structure than intended.
-    assert data[366]["hospital_cases"] == '8595'
+    assert data[366]["hospital_cases"] == 8595
     assert data[270]["date"] == '2021-01-31'
     
     # test if can handle no csv file
@@ -81,3 +81,14 @@ def test_cancel_scheduled_update():
     
     # test bad update_name
     cdh.cancel_scheduled_update("this_doesn't_exist")
+
+def test_cancel_running_repeat_update():
+    # test an update cancelled just after the scheduler took it off the queue doesn't run or repeat
+    len_of_queue = len(cdh.scheduler.queue)
+    cdh.schedule_covid_updates(update_interval=60, update_name='race', repeat=True)
+    event = cdh.scheduled_updates['race'].event
+    cdh.scheduler.cancel(event) # what the scheduler does before running the event
+    cdh.cancel_scheduled_update('race')
+    event.action(*event.argument)
+    assert len(cdh.scheduler.queue) == len_of_queue
+    assert 'race' not in cdh.scheduled_updates
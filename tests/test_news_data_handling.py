@@ -13,6 +13,47 @@ def test_news_API_request():
 def test_update_news():
     cnh.update_news('test')
 
+class FakeResponse:
+    # stands in for requests.Response so a 304 can be tested without the news API
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {"ETag": '"etag test"'}
+        self._data = data
+
+    def json(self):
+        return self._data
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.sent_headers = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.sent_headers.append(headers)
+        return self.responses.pop(0)
+
+def test_update_news_not_modified():
+    # test news is kept when the API says it has not changed since the last request
+    temp_session = cnh._session
+    temp_news = cnh.news[:]
+    articles = [{"title": "ETag", "url": "https://example.com/etag", "content": "Not modified"}]
+    cnh._session = FakeSession([
+        FakeResponse(200, {"status": "ok", "articles": articles}),
+        FakeResponse(304)
+    ])
+    cnh.update_news('etag test')
+    assert cnh.news == articles
+    formatted_news = cnh.formatted_news[:]
+    cnh.update_news('etag test')
+    assert cnh._session.sent_headers == [{}, {"If-None-Match": '"etag test"'}]
+    assert cnh.news == articles
+    assert cnh.formatted_news == formatted_news
+
+    cnh._session = temp_session
+    cnh.news[:] = temp_news
+    cnh.news_formatter()
+
 def test_news_formatter():
     cnh.news_formatter()
 
@@ -67,4 +108,34 @@ def test_cancel_scheduled_update():
     assert len(cnh.scheduler.queue) == len_of_queue
     
     # test bad update_name
-    cnh.cancel_scheduled_update("this_doesn't_exist")
\ No newline at end of file
+    cnh.cancel_scheduled_update("this_doesn't_exist")
+
+def test_cancel_running_repeat_update():
+    # test an update cancelled just after the scheduler took it off the queue doesn't run or repeat
+    len_of_queue = len(cnh.scheduler.queue)
+    cnh.schedule_news_updates(update_interval=60, update_name='race', repeat=True)
+    event = cnh.scheduled_updates['race'].event
+    cnh.scheduler.cancel(event) # what the scheduler does before running the event
+    cnh.cancel_scheduled_update('race')
+    event.action(*event.argument)
+    assert len(cnh.scheduler.queue) == len_of_queue
+    assert 'race' not in cnh.scheduled_updates
+
+def test_news_formatter_content():
+    # test missing content and HTML in content and urls is escaped
+    temp_news = cnh.news[:]
+    cnh.news[:] = [
+        {"title": "Escaped", "url": "https://example.com/a?b=1&c='d'",
+         "content": "<b>Bold</b> news"},
+        {"title": "No content", "url": "https://example.com/b", "content": None}
+    ]
+    cnh.news_formatter()
+    assert cnh.formatted_news[0]["content"] == (
+        "<a href='https://example.com/a?b=1&amp;c=&#39;d&#39;' style='color:black'>"
+        "&lt;b&gt;Bold&lt;/b&gt; news...</a>"
+    )
+    assert cnh.formatted_news[1]["content"] == (
+        "<a href='https://example.com/b' style='color:black'>...</a>"
+    )
+    cnh.news[:] = temp_news
+    cnh.news_formatter()